@@ -1,6 +1,9 @@
 from fastapi import FastAPI, HTTPException
+from fastapi.responses import ORJSONResponse, StreamingResponse
 from pydantic import BaseModel
 from typing import Dict, List, Optional, Any
+from contextlib import asynccontextmanager
+import asyncio
 import os
 import json
 import logging
@@ -9,7 +12,18 @@ import logging
 from router_engine import RouterEngineV1
 from llm_gateway import LLMGateway
 
-app = FastAPI(title="Antigravity Router API", version="1.0.0")
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    yield
+    # Shutdown: release pooled provider connections
+    await gateway.close()
+
+app = FastAPI(
+    title="Antigravity Router API",
+    version="1.0.0",
+    lifespan=lifespan,
+    default_response_class=ORJSONResponse, # orjson: faster serialization on every response
+)
 
 # Initialize Engines
 logging.basicConfig(level=logging.INFO)
@@ -31,10 +45,16 @@ class RouteRequest(BaseModel):
     product: str = "generic"
     metadata: Dict[str, Any] = {}
     execute_remote: bool = True # If true, Gateway executes the call
+    stream: bool = False # If true (with execute_remote), relay the completion as Server-Sent Events
 
 @app.get("/health")
 def health_check():
-    return {"status": "ok", "version": "v1.prod"}
+    return {
+        "status": "ok",
+        "version": "v1.prod",
+        "decision_cache": router.cache_info(),
+        "response_cache": gateway.cache_info()
+    }
 
 @app.get("/status")
 def system_status():
@@ -44,7 +64,7 @@ def system_status():
     return gateway.get_status()
 
 @app.post("/route")
-def route_traffic(req: RouteRequest):
+async def route_traffic(req: RouteRequest):
     try:
         # 1. Get Deterministic Decision (Antigravity)
         input_data = req.dict()
@@ -52,8 +72,10 @@ def route_traffic(req: RouteRequest):
         decision = router.getRoute(input_data)
         
         # 2. Execute (Gateway) if requested
-        if req.execute_remote:
-            final_response = gateway.execute(decision, input_data)
+        if req.execute_remote and req.stream:
+            return StreamingResponse(gateway.execute_stream(decision, input_data), media_type="text/event-stream")
+        elif req.execute_remote:
+            final_response = await gateway.execute(decision, input_data)
             return final_response
         else:
             return decision
@@ -62,6 +84,27 @@ def route_traffic(req: RouteRequest):
         logger.error(f"Error processing request: {e}")
         raise HTTPException(status_code=500, detail=str(e))
 
+@app.post("/route/batch")
+async def route_batch(reqs: List[RouteRequest]):
+    """
+    Routes many requests in one call. Decisions are computed inline (µs each);
+    upstream calls for items with execute_remote run concurrently.
+    Streaming is not supported here: every item returns a JSON result.
+    """
+    try:
+        inputs = [req.dict() for req in reqs]
+        responses = [router.getRoute(input_data) for input_data in inputs]
+        
+        remote = [i for i, req in enumerate(reqs) if req.execute_remote]
+        results = await asyncio.gather(*[gateway.execute(responses[i], inputs[i]) for i in remote])
+        for i, result in zip(remote, results):
+            responses[i] = result
+        return responses
+
+    except Exception as e:
+        logger.error(f"Error processing batch: {e}")
+        raise HTTPException(status_code=500, detail=str(e))
+
 if __name__ == "__main__":
     import uvicorn
     # Local dev run
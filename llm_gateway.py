@@ -1,10 +1,157 @@
 import os
+import sys
 import time
-import requests
-from typing import Dict, Any
+import asyncio
+import hashlib
+import logging
+from functools import cached_property
+from typing import Dict, Any, AsyncIterator
 
-import google.generativeai as genai
-from openai import OpenAI
+import httpx
+import orjson
+from cachetools import TTLCache
+
+from router_engine import Decision
+
+__all__ = ["LLMGateway"]
+
+# Shared connection pool for the OpenAI-compatible providers (DeepSeek, OpenAI).
+# Keep-alive + HTTP/2 avoid paying a TCP/TLS handshake on every call.
+HTTP_LIMITS = httpx.Limits(max_connections=50, max_keepalive_connections=20)
+HTTP_TIMEOUT = httpx.Timeout(30.0, connect=5.0)
+
+# Generative response cache: identical prompts within the TTL skip the upstream call
+RESPONSE_CACHE_SIZE = 10_000
+RESPONSE_CACHE_TTL_S = 300
+
+# Providers tried, in order, for each route until one returns a result without "error"
+FALLBACK_CHAIN = {
+    "DEEPSEEK": ("DEEPSEEK", "GOOGLE"),
+    "GOOGLE": ("GOOGLE", "DEEPSEEK"),
+    "DEEPSEEK_THEN_GPT5": ("DEEPSEEK_THEN_GPT5", "GOOGLE"),
+}
+
+# Streaming: providers tried in order until one starts producing output.
+# (route providers, fallback providers) - the waterfall escalates DeepSeek -> GPT-5.
+STREAM_CHAIN = {
+    "DEEPSEEK": (("DEEPSEEK",), ("GOOGLE",)),
+    "GOOGLE": (("GOOGLE",), ("DEEPSEEK",)),
+    "DEEPSEEK_THEN_GPT5": (("DEEPSEEK", "GPT5"), ("GOOGLE",)),
+}
+
+# Streaming provider -> (model, estimated cost); model names match the response cache keys
+STREAM_MODELS = {
+    "DEEPSEEK": ("deepseek-chat", 0.002),
+    "GPT5": ("gpt-4-turbo", 0.03),
+    "GOOGLE": ("gemini-pro", 0.001),
+}
+
+logger = logging.getLogger("LLMGateway")
+
+class ProviderUnavailable(Exception):
+    """
+    Provider cannot be called: API key missing or circuit open.
+    """
+
+def is_transient_error(exc):
+    """
+    True for errors worth tripping a breaker on: timeouts, connection failures,
+    429 and 5xx. Client errors (400 for an over-long prompt, 401, ...) say nothing
+    about provider health and must not lock every tenant out.
+    """
+    if isinstance(exc, (httpx.TimeoutException, httpx.TransportError, asyncio.TimeoutError, ConnectionError)):
+        return True
+    # The SDKs are imported lazily: if one raised, it is already in sys.modules
+    openai = sys.modules.get("openai")
+    if openai is not None and isinstance(exc, openai.APIConnectionError):  # includes APITimeoutError
+        return True
+    # openai.APIStatusError -> status_code; google.api_core errors -> code (HTTP status)
+    status = getattr(exc, "status_code", None)
+    if status is None:
+        status = getattr(exc, "code", None)
+    if isinstance(status, int):
+        return status == 429 or status >= 500
+    return False
+
+class CircuitBreaker:
+    """
+    In-process circuit breaker for one provider.
+    closed -> open after `fail_threshold` consecutive transient failures. Once the
+    cooldown elapses a single trial call is let through (half-open): success closes
+    the circuit, failure re-opens it with a doubled cooldown (capped). acquire()
+    hands each admitted call a token that it passes back to record_*; only the
+    trial's token can close the circuit or back it off, so calls that were already
+    in flight when the circuit opened are only counted. A trial that never reports
+    back (e.g. cancelled) is handed out again after another cooldown.
+    """
+    
+    def __init__(self, fail_threshold=5, cooldown_s=30.0, max_cooldown_s=300.0):
+        self.fail_threshold = fail_threshold
+        self.base_cooldown_s = cooldown_s
+        self.max_cooldown_s = max_cooldown_s
+        self.cooldown_s = cooldown_s
+        self.failures = 0
+        self.opened_at = None
+        self.trial_started_at = None
+        self.trial_id = 0
+        
+    @property
+    def state(self):
+        if self.opened_at is None:
+            return "closed"
+        if self.trial_started_at is not None or time.monotonic() - self.opened_at >= self.cooldown_s:
+            return "half_open"
+        return "open"
+        
+    def acquire(self):
+        """
+        None if the call must fail fast; otherwise a token for record_*:
+        0 for a call on a closed circuit, the trial id for the half-open trial.
+        """
+        if self.opened_at is None:
+            return 0
+        now = time.monotonic()
+        if self.trial_started_at is not None:
+            if now - self.trial_started_at < self.cooldown_s:
+                # A trial is in flight: everyone else keeps failing fast
+                return None
+        elif now - self.opened_at < self.cooldown_s:
+            return None
+        # Hand out the (single) half-open trial; a re-handed lease gets a new id
+        self.trial_started_at = now
+        self.trial_id += 1
+        return self.trial_id
+
+    def _holds_trial(self, token):
+        return self.trial_started_at is not None and token == self.trial_id
+        
+    def record_success(self, token):
+        if self.opened_at is None:
+            self.failures = 0
+        elif self._holds_trial(token):
+            self.failures = 0
+            self.opened_at = None
+            self.trial_started_at = None
+            self.cooldown_s = self.base_cooldown_s
+        # Already open: only the trial decides when to close
+        
+    def record_failure(self, token):
+        self.failures += 1
+        if self._holds_trial(token):
+            # Failed half-open trial: back off exponentially
+            self.cooldown_s = min(self.cooldown_s * 2, self.max_cooldown_s)
+            self.opened_at = time.monotonic()
+            self.trial_started_at = None
+        elif self.opened_at is None and self.failures >= self.fail_threshold:
+            self.opened_at = time.monotonic()
+        # Already open: late failures of in-flight calls are only counted
+
+    def record_error(self, token, exc):
+        # A non-transient error is still an answer: the provider is up
+        if is_transient_error(exc):
+            self.record_failure(token)
+        else:
+            self.record_success(token)
 
 class LLMGateway:
     """
@@ -18,78 +165,352 @@ class LLMGateway:
         self.deepseek_key = os.getenv("DEEPSEEK_API_KEY")
         self.google_key = os.getenv("GOOGLE_API_KEY")
         
-        # Initialize Clients
-        self.deepseek_client = None
-        if self.deepseek_key:
-            self.deepseek_client = OpenAI(api_key=self.deepseek_key, base_url="https://api.deepseek.com")
-            
-        self.openai_client = None 
-        if self.openai_key:
-             self.openai_client = OpenAI(api_key=self.openai_key)
-             
-        if self.google_key:
-             genai.configure(api_key=self.google_key)
+        # One pooled HTTP client shared by every OpenAI-compatible SDK client
+        self.http_client = httpx.AsyncClient(limits=HTTP_LIMITS, timeout=HTTP_TIMEOUT, http2=True)
+        
+        # Provider SDK clients are created on first use (see the cached properties
+        # below): openai / google.generativeai are heavy imports on a cold start.
+
+        # One breaker per upstream provider (fail fast while a provider is down)
+        self._breakers = {
+            "deepseek": CircuitBreaker(fail_threshold=5, cooldown_s=30),
+            "google": CircuitBreaker(fail_threshold=5, cooldown_s=30),
+            "openai": CircuitBreaker(fail_threshold=5, cooldown_s=30),
+        }
+
+        # Successful provider responses, keyed by (model, prompt digest)
+        self._response_cache = TTLCache(maxsize=RESPONSE_CACHE_SIZE, ttl=RESPONSE_CACHE_TTL_S)
+        self._cache_hits = 0
+        self._cache_misses = 0
+
+        # Route -> handler dispatch table
+        self._dispatch = {
+            "ANTIGRAVITY": self._static,
+            "DEEPSEEK": self._call_deepseek,
+            "GOOGLE": self._call_google,
+            "DEEPSEEK_THEN_GPT5": self._waterfall,
+        }
+        # Used instead of _dispatch when the decision is flagged speculative
+        self._speculative_dispatch = {
+            "DEEPSEEK_THEN_GPT5": self._speculative_waterfall,
+        }
+        self._stream_dispatch = {
+            "DEEPSEEK": self._stream_deepseek,
+            "GPT5": self._stream_gpt5,
+            "GOOGLE": self._stream_google,
+        }
+
+    @cached_property
+    def deepseek_client(self):
+        if not self.deepseek_key:
+            return None
+        from openai import AsyncOpenAI
+        # No SDK retries: the fallback chain is the retry policy, and 2 retries of
+        # HTTP_TIMEOUT would hold a failing call ~90s before failing over
+        return AsyncOpenAI(api_key=self.deepseek_key, base_url="https://api.deepseek.com", http_client=self.http_client, max_retries=0)
+
+    @cached_property
+    def openai_client(self):
+        if not self.openai_key:
+            return None
+        from openai import AsyncOpenAI
+        return AsyncOpenAI(api_key=self.openai_key, http_client=self.http_client, max_retries=0)
+
+    @cached_property
+    def google_model(self):
+        if not self.google_key:
+            return None
+        import google.generativeai as genai
+        # Gemini talks gRPC: the SDK keeps a single long-lived HTTP/2 channel
+        genai.configure(api_key=self.google_key)
+        return genai.GenerativeModel('gemini-pro')
+
+    async def close(self):
+        """
+        Releases pooled connections. Call on application shutdown.
+        """
+        await self.http_client.aclose()
+
+    def cache_info(self):
+        lookups = self._cache_hits + self._cache_misses
+        return {
+            "hits": self._cache_hits,
+            "misses": self._cache_misses,
+            "size": len(self._response_cache),
+            "hit_rate": self._cache_hits / lookups if lookups else 0.0
+        }
+
+    def _cache_key(self, model: str, text: str):
+        # blake2b: fast, fixed-size key regardless of prompt length
+        return (model, hashlib.blake2b(text.encode("utf-8"), digest_size=16).digest())
+
+    def _cache_get(self, key):
+        result = self._response_cache.get(key)
+        if result is None:
+            self._cache_misses += 1
+            return None
+        self._cache_hits += 1
+        # Copy: callers annotate results (e.g. waterfall "note")
+        return dict(result)
+
+    def _cache_put(self, key, result):
+        self._response_cache[key] = dict(result)
 
     def get_status(self):
          return {
              "openai": "configured" if self.openai_key else "missing_key",
              "deepseek": "configured" if self.deepseek_key else "missing_key",
-             "google": "configured" if self.google_key else "missing_key"
+             "google": "configured" if self.google_key else "missing_key",
+             "circuit_breakers": {name: breaker.state for name, breaker in self._breakers.items()}
          }
         
-    def execute(self, route_decision: Dict[str, Any], input_data: Dict[str, Any]) -> Dict[str, Any]:
+    async def execute(self, route_decision: Decision, input_data: Dict[str, Any]) -> Dict[str, Any]:
         """
         Executes the routing decision.
         If Antigravity -> Returns static confirmation.
-        If DeepSeek/GPT5 -> Calls APIs.
+        If DeepSeek/GPT5 -> Calls APIs (awaited, so the event loop can
+        multiplex concurrent upstream calls).
         """
-        route = route_decision.get("route_selected")
+        route = route_decision.route_selected
         text = input_data.get("text")
         
         response = {
             "route_decision": route_decision,
             "execution_result": None,
+            "fallback_provider": None,
             "provider_latency_ms": 0
         }
         
         start = time.time()
         
-        if route == "ANTIGRAVITY":
-            # Immediate return (0 cost)
-            response["execution_result"] = {
-                "content": "ANTIGRAVITY_STATIC_RESPONSE", 
-                "source": "static_rules",
-                "note": "Traffic handled locally. No LLM cost."
-            }
-            
-        elif route == "DEEPSEEK":
-            response["execution_result"] = self._call_deepseek(text)
+        # Walk the fallback chain; if every step fails, surface the primary error
+        speculative = route_decision.speculative
+        for step in FALLBACK_CHAIN.get(route, (route,)):
+            handler = (speculative and self._speculative_dispatch.get(step)) or self._dispatch.get(step)
+            if not handler:
+                break
+            result = await handler(text)
+            if response["execution_result"] is None:
+                response["execution_result"] = result
+            if "error" not in result:
+                if step != route:
+                    logger.warning(f"Route {route} failed. Fallback to {step}.")
+                    response["execution_result"] = result
+                    response["fallback_provider"] = step
+                break
 
-        elif route == "GOOGLE":
-             response["execution_result"] = self._call_google(text)
+        response["provider_latency_ms"] = (time.time() - start) * 1000
+        return response
+
+    async def execute_stream(self, route_decision: Decision, input_data: Dict[str, Any]) -> AsyncIterator[bytes]:
+        """
+        Streaming variant of execute(), yielding Server-Sent Events:
+        "decision" (the route decision), unnamed content deltas, then "done"
+        or "error". A provider that fails before its first token is skipped
+        (waterfall escalation / fallback); a failure mid-stream ends with "error".
+        Decisions flagged `speculative` still stream through the sequential
+        waterfall: only execute() races DeepSeek against GPT-5.
+        """
+        route = route_decision.route_selected
+        text = input_data.get("text")
+        start = time.time()
+        
+        yield self._sse("decision", route_decision)
+        
+        if route not in STREAM_CHAIN:
+            handler = self._dispatch.get(route)
+            result = await handler(text) if handler else None
+            if result is not None:
+                yield self._sse(None, {"content": result["content"]})
+            yield self._sse("done", {"result": result, "fallback_provider": None, "provider_latency_ms": (time.time() - start) * 1000})
+            return
+        
+        route_providers, fallback_providers = STREAM_CHAIN[route]
+        first_error = None
+        for provider in route_providers + fallback_providers:
+            model, cost = STREAM_MODELS[provider]
+            cache_key = self._cache_key(model, text)
             
-        elif route == "DEEPSEEK_THEN_GPT5":
-            # Waterfall Logic
-            ds_result = self._call_deepseek(text)
-            # Simulated confidence check (mock)
-            if self._is_confident(ds_result):
-                response["execution_result"] = ds_result
-                response["execution_result"]["note"] = "Waterfall: DeepSeek sufficient."
+            cached = self._cache_get(cache_key)
+            if cached is not None:
+                deltas = None
+                first = cached["content"]
             else:
-                # Fallback to GPT-5
-                gpt_result = self._call_gpt5(text)
-                response["execution_result"] = gpt_result
-                response["execution_result"]["note"] = "Waterfall: Escalated to GPT-5."
+                deltas = self._stream_dispatch[provider](text)
+                try:
+                    first = await deltas.__anext__()
+                except StopAsyncIteration:
+                    deltas = None
+                    first = ""
+                except Exception as e:
+                    if first_error is None:
+                        first_error = {"error": str(e), "provider": provider}
+                    continue
+            
+            parts = [first]
+            yield self._sse(None, {"content": first})
+            if deltas is not None:
+                try:
+                    async for delta in deltas:
+                        parts.append(delta)
+                        yield self._sse(None, {"content": delta})
+                except Exception as e:
+                    yield self._sse("error", {"error": str(e), "provider": provider})
+                    return
+                self._cache_put(cache_key, {"content": "".join(parts), "model": model, "cost_estimated": cost})
+            
+            if provider in fallback_providers:
+                logger.warning(f"Route {route} failed. Fallback to {provider}.")
+            yield self._sse("done", {
+                "model": model,
+                "cost_estimated": cost,
+                "fallback_provider": provider if provider in fallback_providers else None,
+                "provider_latency_ms": (time.time() - start) * 1000
+            })
+            return
+        
+        yield self._sse("error", first_error)
 
-        response["provider_latency_ms"] = (time.time() - start) * 1000
-        return response
+    @staticmethod
+    def _sse(event, payload) -> bytes:
+        data = b"data: " + orjson.dumps(payload) + b"\n\n"
+        if event:
+            return b"event: " + event.encode() + b"\n" + data
+        return data
 
-    def _call_deepseek(self, text: str):
+    async def _stream_deepseek(self, text: str):
+        if not self.deepseek_client:
+            raise ProviderUnavailable("DeepSeek API Key missing")
+        breaker = self._breakers["deepseek"]
+        token = breaker.acquire()
+        if token is None:
+            raise ProviderUnavailable("DeepSeek circuit open")
+        try:
+            stream = await self.deepseek_client.chat.completions.create(
+                model="deepseek-chat",
+                messages=[
+                    {"role": "system", "content": "You are a helpful assistant."},
+                    {"role": "user", "content": text},
+                ],
+                stream=True
+            )
+            async for chunk in stream:
+                delta = chunk.choices[0].delta.content if chunk.choices else None
+                if delta:
+                    yield delta
+        except Exception as e:
+            breaker.record_error(token, e)
+            raise
+        breaker.record_success(token)
+
+    async def _stream_google(self, text: str):
+        if not self.google_key:
+            raise ProviderUnavailable("Google API Key missing")
+        breaker = self._breakers["google"]
+        token = breaker.acquire()
+        if token is None:
+            raise ProviderUnavailable("Google circuit open")
+        try:
+            response = await self.google_model.generate_content_async(text, stream=True)
+            async for chunk in response:
+                if chunk.text:
+                    yield chunk.text
+        except Exception as e:
+            breaker.record_error(token, e)
+            raise
+        breaker.record_success(token)
+
+    async def _stream_gpt5(self, text: str):
+        if not self.openai_client:
+            raise ProviderUnavailable("OpenAI API Key missing")
+        breaker = self._breakers["openai"]
+        token = breaker.acquire()
+        if token is None:
+            raise ProviderUnavailable("OpenAI circuit open")
+        try:
+            stream = await self.openai_client.chat.completions.create(
+                model="gpt-4-turbo-preview",
+                messages=[{"role": "user", "content": text}],
+                stream=True
+            )
+            async for chunk in stream:
+                delta = chunk.choices[0].delta.content if chunk.choices else None
+                if delta:
+                    yield delta
+        except Exception as e:
+            breaker.record_error(token, e)
+            raise
+        breaker.record_success(token)
+
+    async def _static(self, text: str):
+        # Immediate return (0 cost)
+        return {
+            "content": "ANTIGRAVITY_STATIC_RESPONSE", 
+            "source": "static_rules",
+            "note": "Traffic handled locally. No LLM cost."
+        }
+
+    async def _waterfall(self, text: str):
+        # Waterfall Logic
+        ds_result = await self._call_deepseek(text)
+        # Simulated confidence check (mock)
+        if self._is_confident(ds_result):
+            ds_result["note"] = "Waterfall: DeepSeek sufficient."
+            return ds_result
+        # Fallback to GPT-5
+        gpt_result = await self._call_gpt5(text)
+        gpt_result["note"] = "Waterfall: Escalated to GPT-5."
+        return gpt_result
+
+    async def _speculative_waterfall(self, text: str):
+        # Races DeepSeek against GPT-5 instead of escalating sequentially:
+        # worst-case latency is max(DeepSeek, GPT-5) instead of their sum, but
+        # GPT-5 is always billed and, if it answers before DeepSeek, its answer
+        # is returned even where _waterfall would have stopped at DeepSeek.
+        ds_task = asyncio.create_task(self._call_deepseek(text))
+        gpt_task = asyncio.create_task(self._call_gpt5(text))
+        try:
+            await asyncio.wait((ds_task, gpt_task), return_when=asyncio.FIRST_COMPLETED)
+            if ds_task.done() and self._is_confident(ds_task.result()):
+                gpt_task.cancel()
+                ds_result = ds_task.result()
+                ds_result["note"] = "Waterfall: DeepSeek sufficient."
+                return ds_result
+            escalated = ds_task.done()
+            gpt_result = await gpt_task
+            if "error" in gpt_result:
+                # GPT-5 failed first: a confident DeepSeek answer still wins
+                ds_result = await ds_task
+                if self._is_confident(ds_result):
+                    ds_result["note"] = "Waterfall: DeepSeek sufficient."
+                    return ds_result
+                escalated = True
+            if escalated:
+                gpt_result["note"] = "Waterfall: Escalated to GPT-5."
+            else:
+                gpt_result["note"] = "Waterfall (speculative): GPT-5 finished first."
+            return gpt_result
+        finally:
+            # Never leave a loser running past the request (e.g. client disconnect)
+            ds_task.cancel()
+            gpt_task.cancel()
+
+    async def _call_deepseek(self, text: str):
         if not self.deepseek_client:
             return {"error": "DeepSeek API Key missing", "content": "Error: Configure DEEPSEEK_API_KEY in Render"}
             
+        cache_key = self._cache_key("deepseek-chat", text)
+        cached = self._cache_get(cache_key)
+        if cached is not None:
+            return cached
+            
+        breaker = self._breakers["deepseek"]
+        token = breaker.acquire()
+        if token is None:
+            return {"error": "DeepSeek circuit open", "content": "DeepSeek API Unavailable"}
+            
         try:
-            response = self.deepseek_client.chat.completions.create(
+            response = await self.deepseek_client.chat.completions.create(
                 model="deepseek-chat",
                 messages=[
                     {"role": "system", "content": "You are a helpful assistant."},
@@ -97,45 +518,76 @@ class LLMGateway:
                 ],
                 stream=False
             )
-            return {
+            breaker.record_success(token)
+            result = {
                 "content": response.choices[0].message.content,
                 "model": "deepseek-chat",
                 "cost_estimated": 0.002 # DeepSeek is cheap
             }
+            self._cache_put(cache_key, result)
+            return result
         except Exception as e:
+            breaker.record_error(token, e)
             return {"error": str(e), "content": "DeepSeek API Error"}
 
-    def _call_google(self, text: str):
+    async def _call_google(self, text: str):
         if not self.google_key:
              return {"error": "Google API Key missing", "content": "Error: Configure GOOGLE_API_KEY in Render"}
         
+        cache_key = self._cache_key("gemini-pro", text)
+        cached = self._cache_get(cache_key)
+        if cached is not None:
+            return cached
+        
+        breaker = self._breakers["google"]
+        token = breaker.acquire()
+        if token is None:
+            return {"error": "Google circuit open", "content": "Google API Unavailable"}
+        
         try:
-            model = genai.GenerativeModel('gemini-pro')
-            response = model.generate_content(text)
-            return {
+            response = await self.google_model.generate_content_async(text)
+            breaker.record_success(token)
+            result = {
                 "content": response.text,
                 "model": "gemini-pro",
                 "cost_estimated": 0.001
             }
+            self._cache_put(cache_key, result)
+            return result
         except Exception as e:
+             breaker.record_error(token, e)
              return {"error": str(e), "content": "Google API Error"}
 
-    def _call_gpt5(self, text: str):
+    async def _call_gpt5(self, text: str):
         if not self.openai_client:
              return {"error": "OpenAI API Key missing", "content": "Error: Configure OPENAI_API_KEY in Render"}
              
+        cache_key = self._cache_key("gpt-4-turbo", text)
+        cached = self._cache_get(cache_key)
+        if cached is not None:
+             return cached
+             
+        breaker = self._breakers["openai"]
+        token = breaker.acquire()
+        if token is None:
+             return {"error": "OpenAI circuit open", "content": "OpenAI API Unavailable"}
+             
         try:
              # Using gpt-4-turbo as proxy for 'gpt-5' or gpt-4o
-             response = self.openai_client.chat.completions.create(
+             response = await self.openai_client.chat.completions.create(
                 model="gpt-4-turbo-preview", 
                 messages=[{"role": "user", "content": text}]
              )
-             return {
+             breaker.record_success(token)
+             result = {
                 "content": response.choices[0].message.content,
                 "model": "gpt-4-turbo",
                 "cost_estimated": 0.03
              }
+             self._cache_put(cache_key, result)
+             return result
         except Exception as e:
+             breaker.record_error(token, e)
              return {"error": str(e), "content": "OpenAI API Error"}
         
     def _is_confident(self, result):
@@ -3,11 +3,117 @@ import json
 import re
 import time
 import logging
+from dataclasses import dataclass, asdict
+from functools import lru_cache
+from types import MappingProxyType
+
+import orjson
+
+try:
+    # Linear-time (DFA) matcher, immune to catastrophic backtracking
+    import re2
+except ImportError:
+    re2 = None
+
+# RE2 has a fixed per-call overhead (~3us) that only pays off on longer inputs;
+# short chatbot messages stay on `re`.
+RE2_MIN_TEXT_LENGTH = 64
+# RE2's \w \b \d \s (and negations) are ASCII-only while `re` is Unicode-aware
+# ("niño", "médico"): patterns using them stay on `re` so routing never depends
+# on input length.
+_RE2_ASCII_CLASS_RE = re.compile(r"(?<!\\)(?:\\\\)*\\[wWbBdDsS]")
+
+# Default category -> route table (ruleset.json "routing_table" overrides it)
+CATEGORY_ROUTE = {
+    "static": "ANTIGRAVITY",
+    "transactional": "ANTIGRAVITY",
+    "conversational": "DEEPSEEK",
+    "critical": "DEEPSEEK_THEN_GPT5",
+}
+
+# Estimated cost per route (USD)
+ROUTE_COST = {
+    "ANTIGRAVITY": 0.0,
+    "DEEPSEEK": 0.002,
+    "DEEPSEEK_THEN_GPT5": 0.025,
+    "GOOGLE": 0.001,
+}
+# A speculative waterfall always bills both DeepSeek and GPT-5
+SPECULATIVE_WATERFALL_COST = ROUTE_COST["DEEPSEEK"] + 0.03
+
+# Decision cache: repeated short phrases ("hola", "precio") skip the whole pipeline.
+# Long texts are rarely repeated verbatim and are not cached to bound memory.
+DECISION_CACHE_SIZE = 8192
+DECISION_CACHE_MAX_TEXT_LENGTH = 200
 
 # Configurar logging básico para auditoría
 logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(levelname)s - %(message)s')
 logger = logging.getLogger("AntigravityRouter")
 
+# Rule A: Global dictionary of free patterns (Greetings, Closings, Short Confirmations)
+FREE_PATTERNS = (
+    "hola", "buenas", "buenos dias", "buenas tardes", "buenas noches",
+    "chau", "adios", "hasta luego", "gracias", "muchas gracias",
+    "ok", "dale", "listo", "bueno", "perfecto", "genial",
+    "si", "no", "claro", "exacto", "correcto", "asi es",
+    "precio", "precios", "info", "ayuda", "menu", "salir"
+)
+
+# Risk: substrings that force a critical risk score
+CRITICAL_KEYWORDS = ("legal", "laboral", "medico", "denuncia")
+
+# Intent categories in match priority order, with their base complexity score
+CATEGORY_PRIORITY = (
+    ("static", 0),
+    ("transactional", 10),
+    ("critical", 80),
+    ("conversational", 25),
+)
+
+@dataclass
+class Decision:
+    """
+    Routing decision / log entry returned by getRoute.
+    Slotted (declared by hand: the runtime image is Python 3.9) to keep the
+    per-request object small; orjson and FastAPI serialize dataclasses directly.
+    """
+    __slots__ = (
+        "timestamp", "input_preview", "channel", "engine_used", "intent", "category",
+        "complexity_score", "risk_score", "route_selected", "estimated_cost",
+        "fallback_used", "speculative", "processing_time_ms", "note",
+    )
+    timestamp: float
+    input_preview: str
+    channel: str
+    engine_used: str
+    intent: str
+    category: str
+    complexity_score: int
+    risk_score: int
+    route_selected: str
+    estimated_cost: float
+    fallback_used: bool
+    speculative: bool
+    processing_time_ms: float
+    note: str
+    
+    def stamped(self, timestamp, processing_time_ms):
+        # Fresh copy with per-request fields (much cheaper than dataclasses.replace)
+        return Decision(
+            timestamp, self.input_preview, self.channel, self.engine_used, self.intent,
+            self.category, self.complexity_score, self.risk_score, self.route_selected,
+            self.estimated_cost, self.fallback_used, self.speculative, processing_time_ms,
+            self.note,
+        )
+
+def _freeze(value):
+    # Read-only view of the parsed ruleset: dicts -> MappingProxyType, lists -> tuples
+    if isinstance(value, dict):
+        return MappingProxyType({k: _freeze(v) for k, v in value.items()})
+    if isinstance(value, list):
+        return tuple(_freeze(v) for v in value)
+    return value
+
 class RouterEngineV1:
     """
     Antigravity Router V1 - Deterministic Decision Engine
@@ -15,29 +121,92 @@ class RouterEngineV1:
     """
     
     def __init__(self, ruleset_path="ruleset.json"):
-        with open(ruleset_path, 'r', encoding='utf-8') as f:
-            self.rules = json.load(f)
+        with open(ruleset_path, 'rb') as f:
+            self.rules = _freeze(orjson.loads(f.read()))
+        
+        # Flatten rule paths read on every request. Name-keyed dicts are already a
+        # single probe (str hashes are cached); int ids into parallel lists would
+        # add a name -> id lookup on top and measured slower.
+        self._channel_risk = {
+            name: rules["risk_modifier"] for name, rules in self.rules["channel_rules"].items()
+        }
+        self._product_risk = {
+            name: rules.get("risk_modifier", 0) for name, rules in self.rules["product_rules"].items()
+        }
+        # Products that race DeepSeek and GPT-5 on the waterfall route (latency over cost)
+        self._speculative_products = frozenset(
+            name for name, rules in self.rules["product_rules"].items() if rules.get("speculative_waterfall")
+        )
+        self._risk_high = self.rules["thresholds"]["risk"]["high"]
+        self._cost_limit = self.rules["financial_guardrails"]["max_cost_per_request_usd"]
         
         # Pre-compile regexes for performance
         self._compile_regexes()
+        self._category_route = self.rules.get("routing_table", CATEGORY_ROUTE)
+        
+        # Memoized pure decision (per instance, so a reloaded ruleset starts cold)
+        self._decide_cached = lru_cache(maxsize=DECISION_CACHE_SIZE)(self._decide)
         
     def _compile_regexes(self):
-        self.compiled_intents = {}
-        for category, intent_list in self.rules["intents"].items():
-            for item in intent_list:
+        self._category_matchers = self._build_category_matchers(use_re2=False)
+        # Long inputs go through RE2 when installed: linear time regardless of length
+        self._category_matchers_long = self._category_matchers
+        if re2 is not None:
+            self._category_matchers_long = self._build_category_matchers(use_re2=True)
+        self._conditional_re = re.compile(r"(si|depende|cuando)")
+        self._critical_kw_re = re.compile("(" + "|".join(map(re.escape, CRITICAL_KEYWORDS)) + ")")
+        # Anything shorter than the shortest keyword cannot match
+        self._critical_kw_min_len = min(map(len, CRITICAL_KEYWORDS))
+
+        # Rule A: hashed exact lookup + one anchored alternation for the prefix test.
+        # Longest first so "buenas tardes" wins over "buenas". Only the first
+        # < 20 chars are ever inspected, so an Aho-Corasick automaton (or a
+        # trie-factored pattern) measures no faster than this literal alternation.
+        self._free_patterns = frozenset(FREE_PATTERNS)
+        self._free_prefix_re = re.compile(
+            r'^(?:' + '|'.join(map(re.escape, sorted(self._free_patterns, key=len, reverse=True))) + r')\b'
+        )
+        self._punct_re = re.compile(r'[^\w\s]')
+
+    def _build_category_matchers(self, use_re2):
+        # One combined regex per category (named group per intent), in priority order.
+        # A single .search() tells whether the category matches at all; the leftmost
+        # hit may belong to a later intent, so only the intents declared before it
+        # are re-checked to keep first-declared-intent-wins semantics.
+        # Matching runs on lowercased text, so IGNORECASE (which disables sre's
+        # literal-prefix scan) is only kept for patterns with uppercase characters.
+        matchers = []
+        for category, base_score in CATEGORY_PRIORITY:
+            groups = []
+            intents = []
+            for item in self.rules["intents"].get(category, []):
                 if item["patterns"]:
                     # Join patterns with OR
                     full_pattern = "|".join(item["patterns"])
-                    self.compiled_intents[item["name"]] = {
-                        "regex": re.compile(full_pattern, re.IGNORECASE),
-                        "category": category
-                    }
+                    groups.append("(?P<i%d>%s)" % (len(intents), full_pattern))
+                    intents.append((item["name"], self._compile_intent_regex(full_pattern, use_re2)))
+            if groups:
+                combined = self._compile_intent_regex("|".join(groups), use_re2)
+                indexes = {"i%d" % i: i for i in range(len(intents))}
+                matchers.append((category, base_score, combined, indexes, intents))
+        return matchers
+
+    @staticmethod
+    def _compile_intent_regex(pattern, use_re2):
+        ignore_case = any(c.isupper() for c in pattern.replace("?P<", ""))
+        if use_re2 and not _RE2_ASCII_CLASS_RE.search(pattern):
+            try:
+                return re2.compile("(?i)" + pattern if ignore_case else pattern)
+            except re2.error:
+                # Lookarounds/backreferences are not supported by RE2
+                pass
+        return re.compile(pattern, re.IGNORECASE if ignore_case else 0)
 
-    def _match_intent(self, text, missing_slots):
-        text = text.strip()
+    def _match_intent(self, text_lower, has_missing_slots):
+        # text_lower: lowercased, stripped input (computed once in _decide)
         
         # 1. Check Missing Slots (Hard Rule)
-        if missing_slots and len(missing_slots) > 0:
+        if has_missing_slots:
             return "slot_filling", "transactional", 10
 
         # 2. Check Static/Transactional/Conversational/Critical Regexes
@@ -54,50 +223,35 @@ class RouterEngineV1:
         # Let's match by category priority defined in implementation plan? No, user says:
         # "Static intents -> ANTIGRAVITY" (First check)
         
-        # Check Static First
-        for intent_name, data in self.compiled_intents.items():
-            if data["category"] == "static":
-                if data["regex"].search(text):
-                    return intent_name, "static", 0
-        
-        # Check Transactional (regex based)
-        for intent_name, data in self.compiled_intents.items():
-            if data["category"] == "transactional":
-                if data["regex"].search(text):
-                    return intent_name, "transactional", 10
-
-        # Check Critical
-        for intent_name, data in self.compiled_intents.items():
-            if data["category"] == "critical":
-                if data["regex"].search(text):
-                    return intent_name, "critical", 80
-
-        # Check Conversational
-        for intent_name, data in self.compiled_intents.items():
-            if data["category"] == "conversational":
+        # Static > Transactional > Critical > Conversational, one scan per category
+        if len(text_lower) < RE2_MIN_TEXT_LENGTH:
+            matchers = self._category_matchers
+        else:
+            matchers = self._category_matchers_long
+        for category, score, combined, indexes, intents in matchers:
+            m = combined.search(text_lower)
+            if not m:
+                continue
+            index = indexes[m.lastgroup]
+            intent_name = intents[index][0]
+            for name, regex in intents[:index]:
+                if regex.search(text_lower):
+                    intent_name = name
+                    break
+            if category == "conversational" and self._conditional_re.search(text_lower):
                 # Special logic for conditionals mentioned in prompt can be refined here
-                score = 40 if re.search(r"(si|depende|cuando)", text) else 25
-                if data["regex"].search(text):
-                    return intent_name, "conversational", score
+                score = 40
+            return intent_name, category, score
 
         # Fallback
-        if len(text.split()) > 7:
+        if len(text_lower.split()) > 7:
              return "explanation_request", "conversational", 40
              
         return "unknown", "static", 0 # Default low cost
 
-    def _calculate_risk(self, text, intent, category, metadata):
-        risk = 0
-        channel = metadata.get("channel", "web")
-        product = metadata.get("product", "generic")
-        
-        # Channel Rules
-        if channel in self.rules["channel_rules"]:
-            risk += self.rules["channel_rules"][channel]["risk_modifier"]
-            
-        # Product Rules
-        if product in self.rules["product_rules"]:
-            risk += self.rules["product_rules"][product].get("risk_modifier", 0)
+    def _calculate_risk(self, text_lower, category, channel, product, user_tier):
+        # Channel + Product Rules
+        risk = self._channel_risk.get(channel, 0) + self._product_risk.get(product, 0)
             
         # Intent/Category Base Risk
         if category == "critical":
@@ -106,123 +260,118 @@ class RouterEngineV1:
             risk += 20
             
         # Hard Keywords Risk (from prompt)
-        text_lower = text.lower()
-        if re.search(r"(legal|laboral|medico|denuncia)", text_lower):
+        if len(text_lower) >= self._critical_kw_min_len and self._critical_kw_re.search(text_lower):
             risk = max(risk, 60)
             
         # Enterprise Tier
-        if metadata.get("user_tier") == "enterprise":
+        if user_tier == "enterprise":
             risk += 20
             
         return min(risk, 100)
 
+    def cache_info(self):
+        info = self._decide_cached.cache_info()
+        return {"hits": info.hits, "misses": info.misses, "maxsize": info.maxsize, "currsize": info.currsize}
+
     def getRoute(self, input_data):
-        start_time = time.time()
+        # Wall-clock timestamp is taken once; the duration uses the monotonic clock
+        timestamp = time.time()
+        start_ns = time.perf_counter_ns()
         
         text = input_data.get("text", "")
+        if isinstance(text, bytes):
+            # Keep input_preview a str so the decision stays JSON-serializable
+            text = text.decode("utf-8", "replace")
         metadata = input_data.get("metadata", {})
         channel = input_data.get("channel", "web")
         product = input_data.get("product", "generic")
         missing_slots = metadata.get("missing_slots", [])
         
+        # Everything the decision depends on; only the presence of missing slots matters
+        key = (text, channel, product, bool(missing_slots), input_data.get("user_tier"))
+        if len(text) > DECISION_CACHE_MAX_TEXT_LENGTH:
+            decision = self._decide(*key)
+        else:
+            decision = self._decide_cached(*key)
+        
+        # Cached decisions are shared: hand out a copy with fresh per-request fields
+        return decision.stamped(timestamp, (time.perf_counter_ns() - start_ns) / 1e6)
+
+    @staticmethod
+    def _hard_rule_decision(input_preview, channel, intent, category, complexity_score, note):
+        # Shared shape of the Rule A/B/C early exits (always free, handled locally)
+        return Decision(
+            timestamp=0.0,
+            input_preview=input_preview,
+            channel=channel,
+            engine_used="rules_engine",
+            intent=intent,
+            category=category,
+            complexity_score=complexity_score,
+            risk_score=0,
+            route_selected="ANTIGRAVITY",
+            estimated_cost=0.0001,
+            fallback_used=False,
+            speculative=False,
+            processing_time_ms=0.0,
+            note=note
+        )
+
+    def _decide(self, text, channel, product, has_missing_slots, user_tier):
+        """
+        Pure routing decision for the given inputs (memoized by getRoute).
+        timestamp / processing_time_ms are stamped per request by getRoute.
+        """
         # --- PRIORITY OPTIMIZATIONS (Hard Checks) ---
         
         # RULE C: Aggressive Voice Force (Optimization)
         # If channel is voice and text is short (< 10 chars implies < 2s duration/noise), FORCE ANTIGRAVITY.
         if channel == "voice":
-             if not text or len(text.strip()) < 10:
-                  return {
-                    "timestamp": time.time(),
-                    "input_preview": "voice_noise",
-                    "channel": channel,
-                    "engine_used": "rules_engine",
-                    "intent": "silence_or_noise",
-                    "category": "static",
-                    "complexity_score": 0,
-                    "risk_score": 0,
-                    "route_selected": "ANTIGRAVITY",
-                    "estimated_cost": 0.0001,
-                    "fallback_used": False,
-                    "processing_time_ms": 0.0,
-                    "note": "Rule C: Voice Aggressive Filter"
-                }
+             # strip() only when an edge is whitespace (it can only shorten the text)
+             if len(text) < 10 or ((text[0].isspace() or text[-1].isspace()) and len(text.strip()) < 10):
+                  return self._hard_rule_decision(
+                      "voice_noise", channel, "silence_or_noise", "static", 0,
+                      "Rule C: Voice Aggressive Filter"
+                  )
 
         # RULE B: Strict Slot Filling
         # If any slots are missing, it IS transactional. No debate.
-        if missing_slots and len(missing_slots) > 0:
-             return {
-                "timestamp": time.time(),
-                "input_preview": text[:50],
-                "channel": channel,
-                "engine_used": "rules_engine",
-                "intent": "slot_filling",
-                "category": "transactional",
-                "complexity_score": 10,
-                "risk_score": 0,
-                "route_selected": "ANTIGRAVITY",
-                "estimated_cost": 0.0001,
-                "fallback_used": False,
-                "processing_time_ms": 0.0,
-                "note": "Rule B: Strict Slot Filling"
-            }
+        if has_missing_slots:
+             return self._hard_rule_decision(
+                 text[:50], channel, "slot_filling", "transactional", 10,
+                 "Rule B: Strict Slot Filling"
+             )
 
         # RULE A: Global Free Patterns (Strict)
         # Global dictionary of free patterns. If text MATCHES any of these (heuristic: short & confident), FORCE ANTIGRAVITY.
         # Patterns: Greetings, Closings, Short Confirmations.
         # Implemented as checking if the ENTIRE text is a match or contained in a short phrase.
         
-        free_patterns = [
-            "hola", "buenas", "buenos dias", "buenas tardes", "buenas noches", 
-            "chau", "adios", "hasta luego", "gracias", "muchas gracias",
-            "ok", "dale", "listo", "bueno", "perfecto", "genial",
-            "si", "no", "claro", "exacto", "correcto", "asi es",
-            "precio", "precios", "info", "ayuda", "menu", "salir"
-        ]
-        
         text_lower = text.lower().strip()
         # Clean punctuation for better matching
-        text_clean = re.sub(r'[^\w\s]', '', text_lower)
+        text_clean = self._punct_re.sub('', text_lower)
         
         # Check 1: Exact Match (High Confidence)
-        if text_clean in free_patterns:
-             is_free = True
-        # Check 2: Starts with pattern and is short (< 20 chars)
-        elif len(text_clean) < 20 and any(text_clean.startswith(p) for p in free_patterns):
-             is_free = True
-        else:
-             is_free = False
+        # Check 2: Starts with a whole pattern word and is short (< 20 chars)
+        is_free = text_clean in self._free_patterns or (
+            len(text_clean) < 20 and self._free_prefix_re.match(text_clean) is not None
+        )
              
         if is_free:
-             return {
-                "timestamp": time.time(),
-                "input_preview": text[:50],
-                "channel": channel,
-                "engine_used": "rules_engine",
-                "intent": "quick_confirmation",
-                "category": "static",
-                "complexity_score": 0,
-                "risk_score": 0,
-                "route_selected": "ANTIGRAVITY",
-                "estimated_cost": 0.0001,
-                "fallback_used": False,
-                "processing_time_ms": 0.0,
-                "note": "Rule A: Global Free Patterns"
-            }
+             return self._hard_rule_decision(
+                 text[:50], channel, "quick_confirmation", "static", 0,
+                 "Rule A: Global Free Patterns"
+             )
 
         # 1. Intent Detection
-        intent, category, complexity_score = self._match_intent(text, missing_slots)
+        intent, category, complexity_score = self._match_intent(text_lower, has_missing_slots)
         
         # 2. Financial/Product Overrides
-        # Product Specific Rules
-        if product in self.rules["product_rules"]:
-            rule = self.rules["product_rules"][product]
-            if "min_category_if_not_static" in rule:
-                 if category not in ["static", "transactional"]:
-                      # Check upgrades only if NOT caught by Rule A/B previously
-                      pass 
+        # Product Specific Rules: "min_category_if_not_static" upgrades are not
+        # applied yet (would only apply if NOT caught by Rule A/B previously).
 
         # 3. Risk Calculation
-        risk_score = self._calculate_risk(text, intent, category, input_data)
+        risk_score = self._calculate_risk(text_lower, category, channel, product, user_tier)
         
         # 4. Final Routing Decision (The "NO Negotiable" Order)
         # - Static intents → ANTIGRAVITY
@@ -231,45 +380,33 @@ class RouterEngineV1:
         # - Medium reasoning → DEEPSEEK
         # - High risk / decisión crítica → GPT-5
         
-        final_route = "ANTIGRAVITY"
         engine_used = "rules_engine"
-        
-        if category == "static":
-            final_route = "ANTIGRAVITY"
-        elif category == "transactional":
-            final_route = "ANTIGRAVITY"
-        elif category == "conversational":
-            final_route = "DEEPSEEK"
-        elif category == "critical":
-            final_route = "DEEPSEEK_THEN_GPT5"
+        final_route = self._category_route.get(category, "ANTIGRAVITY")
         
         # Complexity/Risk Threshold Overrides
         # "High risk / decisión crítica → GPT-5"
-        if risk_score >= self.rules["thresholds"]["risk"]["high"]:
+        if risk_score >= self._risk_high:
             final_route = "DEEPSEEK_THEN_GPT5"
             category = "critical" # Force category update for consistency
             
         target = final_route
 
         # 5. Financial Safeguards
-        # Timeout Check
-        max_timeout = self.rules["financial_guardrails"]["timeouts_ms"].get(channel, 5000)
-        estimated_latency = 0 # Placeholder for simulation
+        # Timeout Check: per-channel "timeouts_ms" is not simulated here (no latency estimate yet)
         
         # Cost Limit Check
-        # Estimate cost based on route
-        estimated_cost = 0.0
-        if target == "ANTIGRAVITY": estimated_cost = 0.0000
-        elif target == "DEEPSEEK": estimated_cost = 0.002
-        elif target == "DEEPSEEK_THEN_GPT5": estimated_cost = 0.025
+        # Estimate cost based on route (and on whether the waterfall races both providers)
+        speculative = target == "DEEPSEEK_THEN_GPT5" and product in self._speculative_products
+        estimated_cost = SPECULATIVE_WATERFALL_COST if speculative else ROUTE_COST.get(target, 0.0)
         
-        hard_limit = self.rules["financial_guardrails"]["max_cost_per_request_usd"]
+        hard_limit = self._cost_limit
         fallback_used = False
         
         if estimated_cost > hard_limit:
             logger.warning(f"Cost limit exceeded ({estimated_cost} > {hard_limit}). Fallback to ANTIGRAVITY.")
             target = "ANTIGRAVITY"
             fallback_used = True
+            speculative = False
             estimated_cost = 0.0001
 
         # Log Metrics
@@ -279,20 +416,22 @@ class RouterEngineV1:
         # - estimated_cost
         # - fallback_used (true/false)
         
-        log_entry = {
-            "timestamp": time.time(),
-            "input_preview": text[:50],
-            "channel": channel,
-            "engine_used": engine_used,
-            "intent": intent,
-            "category": category,
-            "complexity_score": complexity_score,
-            "risk_score": risk_score,
-            "route_selected": target,
-            "estimated_cost": estimated_cost,
-            "fallback_used": fallback_used,
-            "processing_time_ms": (time.time() - start_time) * 1000
-        }
+        log_entry = Decision(
+            timestamp=0.0,
+            input_preview=text[:50],
+            channel=channel,
+            engine_used=engine_used,
+            intent=intent,
+            category=category,
+            complexity_score=complexity_score,
+            risk_score=risk_score,
+            route_selected=target,
+            estimated_cost=estimated_cost,
+            fallback_used=fallback_used,
+            speculative=speculative,
+            processing_time_ms=0.0,
+            note=""
+        )
         
         # In production this goes to ELK/Datadog. Here we verify.
         return log_entry
@@ -311,5 +450,5 @@ if __name__ == "__main__":
     print("ROUTER V1 EXECUTION LOG")
     for inp in inputs:
         result = engine.getRoute(inp)
-        print(json.dumps(result, indent=2))
+        print(json.dumps(asdict(result), indent=2))
 
@@ -0,0 +1,192 @@
+import asyncio
+from types import SimpleNamespace
+
+import httpx
+import pytest
+
+import llm_gateway
+from llm_gateway import CircuitBreaker, LLMGateway, is_transient_error
+
+
+class FakeClock:
+    def __init__(self):
+        self.now = 1000.0
+
+    def __call__(self):
+        return self.now
+
+
+@pytest.fixture
+def clock(monkeypatch):
+    clock = FakeClock()
+    monkeypatch.setattr(llm_gateway.time, "monotonic", clock)
+    return clock
+
+
+def test_opens_after_threshold(clock):
+    breaker = CircuitBreaker(fail_threshold=5, cooldown_s=30)
+    for _ in range(4):
+        breaker.record_failure(breaker.acquire())
+    assert breaker.state == "closed"
+    assert breaker.acquire() == 0
+    breaker.record_failure(0)
+    assert breaker.state == "open"
+    assert breaker.acquire() is None
+
+
+def test_success_resets_consecutive_failures(clock):
+    breaker = CircuitBreaker(fail_threshold=3)
+    breaker.record_failure(0)
+    breaker.record_failure(0)
+    breaker.record_success(0)
+    breaker.record_failure(0)
+    breaker.record_failure(0)
+    assert breaker.state == "closed"
+
+
+def test_single_half_open_trial(clock):
+    breaker = CircuitBreaker(fail_threshold=1, cooldown_s=30)
+    breaker.record_failure(0)
+    clock.now += 30
+    assert breaker.state == "half_open"
+    assert breaker.acquire()  # the trial
+    assert breaker.acquire() is None  # concurrent callers still fail fast
+    assert breaker.acquire() is None
+
+
+def test_trial_success_closes(clock):
+    breaker = CircuitBreaker(fail_threshold=1, cooldown_s=30)
+    breaker.record_failure(0)
+    clock.now += 30
+    trial = breaker.acquire()
+    breaker.record_success(trial)
+    assert breaker.state == "closed"
+    assert breaker.cooldown_s == 30
+
+
+def test_trial_failure_doubles_cooldown_capped(clock):
+    breaker = CircuitBreaker(fail_threshold=1, cooldown_s=30, max_cooldown_s=100)
+    breaker.record_failure(0)
+    for expected in (60, 100, 100):
+        clock.now += breaker.cooldown_s
+        trial = breaker.acquire()
+        assert trial
+        breaker.record_failure(trial)
+        assert breaker.cooldown_s == expected
+        assert breaker.state == "open"
+
+
+def test_failures_while_open_do_not_back_off(clock):
+    breaker = CircuitBreaker(fail_threshold=5, cooldown_s=30)
+    in_flight = [breaker.acquire() for _ in range(50)]
+    for token in in_flight[:5]:
+        breaker.record_failure(token)
+    opened_at = breaker.opened_at
+    clock.now += 10
+    for token in in_flight[5:]:
+        breaker.record_failure(token)
+    assert breaker.cooldown_s == 30
+    assert breaker.opened_at == opened_at
+    clock.now += 20
+    assert breaker.acquire()
+
+
+def test_straggler_fails_while_trial_outstanding(clock):
+    breaker = CircuitBreaker(fail_threshold=1, cooldown_s=30)
+    first, straggler = breaker.acquire(), breaker.acquire()
+    breaker.record_failure(first)
+    clock.now += 30  # the straggler outlasts the cooldown
+    trial = breaker.acquire()
+    assert trial
+    breaker.record_failure(straggler)
+    assert breaker.cooldown_s == 30
+    assert breaker.trial_started_at is not None
+    assert breaker.acquire() is None  # still one trial only
+    breaker.record_success(straggler)
+    assert breaker.state == "half_open"  # only the trial closes
+    breaker.record_success(trial)
+    assert breaker.state == "closed"
+
+
+def test_unreported_trial_is_handed_out_again(clock):
+    breaker = CircuitBreaker(fail_threshold=1, cooldown_s=30)
+    breaker.record_failure(0)
+    clock.now += 30
+    stale = breaker.acquire()  # trial gets cancelled, never reports
+    clock.now += 29
+    assert breaker.acquire() is None
+    clock.now += 1
+    trial = breaker.acquire()
+    assert trial and trial != stale
+    breaker.record_failure(stale)  # the first lease reporting late is a straggler
+    assert breaker.cooldown_s == 30
+    breaker.record_success(trial)
+    assert breaker.state == "closed"
+
+
+def test_client_errors_do_not_trip(clock):
+    breaker = CircuitBreaker(fail_threshold=2)
+    for _ in range(5):
+        breaker.record_error(breaker.acquire(), ValueError("bad request"))
+    assert breaker.state == "closed"
+
+
+@pytest.mark.parametrize("exc, transient", [
+    (httpx.ConnectError("refused"), True),
+    (httpx.ReadTimeout("slow"), True),
+    (asyncio.TimeoutError(), True),
+    (type("RateLimit", (Exception,), {"status_code": 429})(), True),
+    (type("ServerError", (Exception,), {"status_code": 503})(), True),
+    (type("BadRequest", (Exception,), {"status_code": 400})(), False),
+    (type("GoogleUnavailable", (Exception,), {"code": 503})(), True),
+    (type("GoogleInvalidArgument", (Exception,), {"code": 400})(), False),
+    (RuntimeError("boom"), False),
+])
+def test_is_transient_error(exc, transient):
+    assert is_transient_error(exc) is transient
+
+
+def test_openai_errors():
+    openai = pytest.importorskip("openai")
+    request = httpx.Request("POST", "https://api.example.com")
+    assert is_transient_error(openai.APITimeoutError(request=request))
+    assert is_transient_error(openai.APIConnectionError(request=request))
+    response = httpx.Response(400, request=request)
+    assert not is_transient_error(openai.BadRequestError("too long", response=response, body=None))
+    response = httpx.Response(429, request=request)
+    assert is_transient_error(openai.RateLimitError("slow down", response=response, body=None))
+
+
+class FailingCompletions:
+    def __init__(self, release):
+        self.release = release
+        self.calls = 0
+
+    async def create(self, **kwargs):
+        self.calls += 1
+        await self.release.wait()
+        raise httpx.ConnectError("provider down")
+
+
+def test_concurrent_in_flight_failures_keep_base_cooldown(monkeypatch):
+    monkeypatch.setenv("DEEPSEEK_API_KEY", "test")
+
+    async def run():
+        gateway = LLMGateway()
+        release = asyncio.Event()
+        completions = FailingCompletions(release)
+        gateway.__dict__["deepseek_client"] = SimpleNamespace(chat=SimpleNamespace(completions=completions))
+        try:
+            tasks = [asyncio.ensure_future(gateway._call_deepseek(f"prompt {i}")) for i in range(50)]
+            await asyncio.sleep(0)
+            release.set()
+            results = await asyncio.gather(*tasks)
+        finally:
+            await gateway.close()
+        return gateway._breakers["deepseek"], completions, results
+
+    breaker, completions, results = asyncio.run(run())
+    assert completions.calls == 50
+    assert all("error" in result for result in results)
+    assert breaker.state == "open"
+    assert breaker.cooldown_s == breaker.base_cooldown_s
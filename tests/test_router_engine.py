@@ -0,0 +1,24 @@
+import re
+
+import pytest
+
+from router_engine import RouterEngineV1
+
+
+@pytest.mark.parametrize("pattern, text, expected", [
+    (r"^\w+$", "niño", "niño"),
+    (r"\w+ico", "el médico", "médico"),
+    (r"\bdaño\b", "un daño grave", "daño"),
+])
+def test_unicode_shorthand_classes_stay_on_re(pattern, text, expected):
+    # RE2's shorthand classes are ASCII-only: the long-text matcher must agree with `re`
+    rx = RouterEngineV1._compile_intent_regex(pattern, use_re2=True)
+    assert isinstance(rx, re.Pattern)
+    assert rx.search(text).group(0) == expected
+
+
+def test_literal_patterns_use_re2():
+    pytest.importorskip("re2")
+    rx = RouterEngineV1._compile_intent_regex(r"(legal|laboral)", use_re2=True)
+    assert not isinstance(rx, re.Pattern)
+    assert rx.search("contrato laboral").group(0) == "laboral"
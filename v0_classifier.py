@@ -1,6 +1,43 @@
 
+import os
 import re
 import json
+from functools import lru_cache
+from typing import NamedTuple
+
+try:
+    import ahocorasick
+except ImportError:  # optional: sin el automata se usan las alternancias por tier
+    ahocorasick = None
+
+# Cache de resultados: el tráfico repite mucho ("hola", "precio", "gracias").
+# V0_CLASSIFY_CACHE=0 lo desactiva (debugging).
+CLASSIFY_CACHE_SIZE = 4096
+CLASSIFY_CACHE_MAX_TEXT_LENGTH = 200
+CLASSIFY_CACHE_ENABLED = os.getenv("V0_CLASSIFY_CACHE", "1") != "0"
+
+_ROUTE = {
+    "static": "ANTIGRAVITY",
+    "transactional": "ANTIGRAVITY",
+    "conversational": "DEEPSEEK",
+    "critical": "DEEPSEEK_THEN_GPT5",
+}
+
+# Alternancia de palabras fijas (sin metacaracteres): se resuelve con un frozenset
+_WORD_LIST_RE = re.compile(r"^[\w ]+(\|[\w ]+)*$")
+
+class ClassifyResult(NamedTuple):
+    """
+    Resultado de classify(). Inmutable: el cache lo comparte sin copiar.
+    Para el formato dict (JSON) usar ._asdict().
+    """
+    intent: str
+    category: str
+    complexity_score: int
+    risk_score: int
+    confidence: float
+    route_hint: str
+    reason: str
 
 class V0Classifier:
     """
@@ -35,113 +72,314 @@ class V0Classifier:
             "legal_or_health_related": r"(legal|contrato|salud|medico|denuncia)",
         }
 
-    def _detect_intent_and_complexity(self, text, missing_slots):
-        text = text.lower().strip()
-        complexity = 0
-        intent = "unknown"
+        # Pre-compile una sola vez (classify no vuelve a pasar por el cache de `re`)
+        for intents in (self.STATIC_INTENTS, self.TRANSACTIONAL_INTENTS,
+                        self.CONVERSATIONAL_INTENTS, self.CRITICAL_INTENTS):
+            for int_name, pattern in intents.items():
+                intents[int_name] = re.compile(pattern)
+
+        # Una alternancia por tier: un solo scan descarta el tier entero
+        # Priority: Critical > Conversational > Transactional > Static
+        self._tiers = (
+            ("critical", self._compile_tier(self.CRITICAL_INTENTS)),
+            ("conversational", self._compile_tier(self.CONVERSATIONAL_INTENTS)),
+            ("transactional", self._compile_tier(self.TRANSACTIONAL_INTENTS)),
+            ("static", self._compile_tier(self.STATIC_INTENTS)),
+        )
+
+        # Nombres de intent -> categoría: un solo lookup en _determine_category.
+        # Se carga de menor a mayor precedencia (static gana, como en la cascada original).
+        self._intent_category = {}
+        for category, intent_names in (
+            ("critical", self.CRITICAL_INTENTS),
+            ("conversational", self.CONVERSATIONAL_INTENTS),
+            ("transactional", tuple(self.TRANSACTIONAL_INTENTS) + ("slot_filling",)),
+            ("static", self.STATIC_INTENTS),
+        ):
+            for int_name in intent_names:
+                self._intent_category[int_name] = category
+        self._static_names = frozenset(self.STATIC_INTENTS)
+
+        self._greet_close_words = frozenset(("hola", "gracias", "ok"))
+        # Patrones chicos sobre textos cortos: el costo es la llamada, no el motor.
+        # PCRE2 con JIT (binding `pcre2`) no mejora a `re` acá (ver historial).
+        self._conditional_re = re.compile(r"(si|depende|cuando)")
+        self._risk_channel_re = re.compile(r"(tiempo real|voice)")
+        # Keywords de riesgo en el texto: (patrón, peso); cada grupo suma una sola vez
+        self._risk_keywords = (
+            (re.compile(r"(incorrecto|daño|error)"), 40),
+            (re.compile(r"(legal|laboral)"), 60),
+            (re.compile(r"(salud|accesibilidad)"), 80),
+        )
+        # Peso total por combinación de grupos con hit (índice = bitmask)
+        self._risk_weight = tuple(
+            sum(weight for bit, (_, weight) in enumerate(self._risk_keywords) if mask >> bit & 1)
+            for mask in range(1 << len(self._risk_keywords))
+        )
+        # Keyword de riesgo más corta: textos más cortos no pueden sumar riesgo
+        self._risk_text_min_len = min(self._pattern_min_len(rx.pattern) for rx, _ in self._risk_keywords)
+
+        # Un solo autómata para intents y riesgo: un pase de texto alimenta a ambos
+        self._automaton, self._word_intents = self._build_automaton(self._tiers, self._risk_keywords)
+        if self._automaton is not None:
+            self._keyword_min_len = min(len(keyword) for keyword in self._automaton.keys())
+
+        self._classify_cached = None
+        if CLASSIFY_CACHE_ENABLED:
+            self._classify_cached = lru_cache(maxsize=CLASSIFY_CACHE_SIZE)(self._classify)
+
+    @staticmethod
+    def _compile_tier(intents):
+        # Alternancia plana sin grupos (los grupos nombrados desactivan el prefiltro
+        # de charset de sre y resultan más lentos que los searches sueltos).
+        # Los patrones ^(a|b|c)$ de palabras fijas son un lookup en frozenset: el
+        # texto llega lower().strip()eado, así que equivale a comparar el texto entero.
+        # min_len: largo de la keyword más corta; un texto más corto no puede matchear
+        # el gate (0 si algún patrón no es una lista de literales).
+        words, substrings, checks = set(), [], []
+        keyword_lens = []
+        for int_name, rx in intents.items():
+            pattern = rx.pattern
+            int_words = None
+            if pattern.startswith("^(") and pattern.endswith(")$") and _WORD_LIST_RE.match(pattern[2:-2]):
+                int_words = frozenset(pattern[2:-2].split("|"))
+                words |= int_words
+            elif pattern.startswith("(") and pattern.endswith(")") and "(" not in pattern[1:-1]:
+                substrings.append(pattern[1:-1])
+                keyword_lens.append(V0Classifier._pattern_min_len(pattern))
+            else:
+                substrings.append("(?:%s)" % pattern)
+                keyword_lens.append(0)
+            checks.append((int_name, int_words, rx))
+        substring_rx = re.compile("(?:%s)" % "|".join(substrings)) if substrings else None
+        min_len = min(keyword_lens) if keyword_lens else 0
+        return frozenset(words), substring_rx, tuple(checks), min_len
+
+    @staticmethod
+    def _pattern_min_len(pattern):
+        # Largo de la keyword más corta de un patrón "(a|b|c)" de literales; 0 si no
+        # lo es (no se puede acotar el largo mínimo de un match).
+        if pattern.startswith("(") and pattern.endswith(")") and _WORD_LIST_RE.match(pattern[1:-1]):
+            return min(len(keyword) for keyword in pattern[1:-1].split("|"))
+        return 0
+
+    @staticmethod
+    def _build_automaton(tiers, risk_keywords):
+        # Aho-Corasick: todas las keywords de todos los tiers y de riesgo en un solo pase.
+        # Cada keyword lleva (rank del tier, orden del intent) o None, y el bitmask de
+        # grupos de riesgo. Para el intent el mínimo es el ganador; los bits se acumulan
+        # (Aho-Corasick reporta también matches solapados: "saludaño" -> salud + daño).
+        # Solo aplica si todos los patrones son listas de keywords literales.
+        # Hyperscan se midió como alternativa: ~0.5us menos en textos largos pero más
+        # lento en los cortos (callback Python por match + encode), así que no se usa.
+        if ahocorasick is None:
+            return None, ()
+        entries = {}
+        word_intents = []
+        for tier_rank, (tier_name, (_, _, checks, _)) in enumerate(tiers):
+            for int_index, (int_name, int_words, rx) in enumerate(checks):
+                key = (tier_rank, int_index, tier_name, int_name)
+                if int_words is not None:
+                    word_intents.append(key + (int_words,))
+                    continue
+                pattern = rx.pattern
+                if not (pattern.startswith("(") and pattern.endswith(")") and _WORD_LIST_RE.match(pattern[1:-1])):
+                    return None, ()
+                for keyword in pattern[1:-1].split("|"):
+                    entry = entries.setdefault(keyword, [None, 0])
+                    if entry[0] is None or key < entry[0]:
+                        entry[0] = key
+        for bit, (rx, _) in enumerate(risk_keywords):
+            pattern = rx.pattern
+            if not (pattern.startswith("(") and pattern.endswith(")") and _WORD_LIST_RE.match(pattern[1:-1])):
+                return None, ()
+            for keyword in pattern[1:-1].split("|"):
+                entries.setdefault(keyword, [None, 0])[1] |= 1 << bit
+        automaton = ahocorasick.Automaton()
+        for keyword, (key, risk_bits) in entries.items():
+            automaton.add_word(keyword, (key, risk_bits))
+        automaton.make_automaton()
+        return automaton, tuple(word_intents)
+
+    def _scan_keywords(self, text):
+        # -> (tier, intent, bitmask de riesgo) en un solo pase
+        best = None
+        risk_hits = 0
+        if len(text) >= self._keyword_min_len:
+            for _, (hit, risk_bits) in self._automaton.iter(text):
+                risk_hits |= risk_bits
+                if hit is not None and (best is None or hit < best):
+                    best = hit
+        # Intents de palabras fijas (texto completo) declarados antes del mejor hit
+        for word_intent in self._word_intents:
+            if best is not None and word_intent[:2] > best[:2]:
+                break
+            if text in word_intent[4]:
+                best = word_intent
+                break
+        if best is None:
+            return None, None, risk_hits
+        return best[2], best[3], risk_hits
+
+    def _scan_tiers(self, text):
+        for tier_name, tier in self._tiers:
+            int_name = self._search_tier(tier, text)
+            if int_name:
+                return tier_name, int_name
+        return None, None
+
+    @staticmethod
+    def _search_tier(tier, text):
+        words, substring_rx, checks, min_len = tier
+        if text not in words and (len(text) < min_len or not (substring_rx and substring_rx.search(text))):
+            return None
+        # Hubo hit: gana el primer intent declarado que matchea (orden original)
+        for int_name, int_words, rx in checks:
+            if text in int_words if int_words is not None else rx.search(text):
+                return int_name
+
+    def _detect_intent_and_complexity(self, text, missing_slots, keyword_hits=None):
+        # text: lowercased, stripped input (computed once in classify)
+        # keyword_hits: resultado de _scan_keywords (None sin autómata)
 
         # Heurística 1: greeting/closing simples
-        if re.match(r"^(hola|gracias|ok)$", text):
-            return "greeting" if "hola" in text else "closing", 0
+        if text in self._greet_close_words:
+            return "greeting" if text == "hola" else "closing", 0
 
         # Heurística 2: Missing Slots -> Transactional
-        if missing_slots and len(missing_slots) > 0:
+        if missing_slots:
             return "slot_filling", 10 # Pedido simple
 
         # Regex Matching for other intents
         # Priority: Critical > Conversational > Transactional > Static
+        if keyword_hits is not None:
+            tier_name, int_name, _ = keyword_hits
+        else:
+            tier_name, int_name = self._scan_tiers(text)
         
         # 1. Critical
-        for int_name, pattern in self.CRITICAL_INTENTS.items():
-            if re.search(pattern, text):
-                return int_name, 80 # Juicio humano
+        if tier_name == "critical":
+            return int_name, 80 # Juicio humano
         
         # 2. Conversational
-        for int_name, pattern in self.CONVERSATIONAL_INTENTS.items():
-            if re.search(pattern, text):
-                # Calcular complejidad extra
-                if re.search(r"(si|depende|cuando)", text):
-                    return int_name, 40 # Condicionales
-                return int_name, 25 # Múltiples preguntas
+        if tier_name == "conversational":
+            # Calcular complejidad extra
+            if self._conditional_re.search(text):
+                return int_name, 40 # Condicionales
+            return int_name, 25 # Múltiples preguntas
         
         # 3. Transactional
-        for int_name, pattern in self.TRANSACTIONAL_INTENTS.items():
-            if re.search(pattern, text):
-                return int_name, 10
+        if tier_name == "transactional":
+            return int_name, 10
         
         # 4. Static
-        for int_name, pattern in self.STATIC_INTENTS.items():
-            if re.search(pattern, text):
-                return int_name, 0
+        if tier_name == "static":
+            return int_name, 0
 
         # Default fallback logic if nothing matches but we need to classify
-        if len(text.split()) > 10:
+        # maxsplit=10: como mucho 11 piezas, hay una 11va solo si hay > 10 palabras
+        if len(text.split(None, 10)) > 10:
              return "explanation_request", 25
         
         return "system_command", 0
 
-    def _calculate_risk(self, product, intent, metadata):
+    def _calculate_risk(self, product, intent, text, channel, is_interview, user_tier, risk_hits=None):
+        # text: lowercased, stripped input (computed once in classify)
+        # risk_hits: bitmask de grupos de riesgo ya recolectado por _scan_keywords
         risk = 0
         
         # Base risk keywords (simplified)
-        text = metadata.get("text", "").lower()
-        if re.search(r"(tiempo real|voice)", metadata.get("channel", "")):
+        if self._risk_channel_re.search(channel):
             risk += 20
-        if re.search(r"(incorrecto|daño|error)", text):
-            risk += 40
-        if re.search(r"(legal|laboral)", text):
-            risk += 60
-        if re.search(r"(salud|accesibilidad)", text):
-            risk += 80
+        if risk_hits is None:
+            risk_hits = 0
+            if len(text) >= self._risk_text_min_len:
+                for bit, (rx, _) in enumerate(self._risk_keywords):
+                    if rx.search(text):
+                        risk_hits |= 1 << bit
+                        # Ya saturado: el resto de los scans no cambia el resultado
+                        if risk + self._risk_weight[risk_hits] >= 100:
+                            break
+        risk += self._risk_weight[risk_hits]
+        # Lo que sigue solo suma (piso de 80, +20 enterprise): saturar acá es final
+        if risk >= 100:
+            return 100
 
         # Context Heuristics
-        if product == "ats" and intent != "greeting":
-             # "Si product === ats Y intent ≠ greeting → mínimo conversational" -> affects category, but let's check risk prompts
-             # "Si is_interview === true → mínimo critical" -> handled in category mostly, but prompt says risk:
-             # "+80 -> accesibilidad / salud / entrevistas"
-             if risk < 80: risk = 80 # Assuming ATS implies interview context often
-
-        if metadata.get("is_interview"):
+        # "Si product === ats Y intent ≠ greeting → mínimo conversational" -> affects category, but let's check risk prompts
+        # "Si is_interview === true → mínimo critical" -> handled in category mostly, but prompt says risk:
+        # "+80 -> accesibilidad / salud / entrevistas"
+        # Both set the same floor of 80 (ATS implies interview context often): one branch.
+        if is_interview or (product == "ats" and intent != "greeting"):
              if risk < 80: risk = 80
         
-        if metadata.get("user_tier") == "enterprise":
+        if user_tier == "enterprise":
             risk += 20
         
-        return min(risk, 100)
+        return risk if risk < 100 else 100
 
     def _determine_category(self, intent, missing_slots, product, is_interview, score_complexity):
         # Default category based on intent groups
-        if intent in self.STATIC_INTENTS: category = "static"
-        elif intent in self.TRANSACTIONAL_INTENTS or intent == "slot_filling": category = "transactional"
-        elif intent in self.CONVERSATIONAL_INTENTS: category = "conversational"
-        elif intent in self.CRITICAL_INTENTS: category = "critical"
-        else:
+        category = self._intent_category.get(intent)
+        if category is None:
             # Fallback based on score
             if score_complexity >= 80: category = "critical"
             elif score_complexity >= 25: category = "conversational"
             else: category = "static"
 
-        # Heurísticas Obligatorias overrides
-        if missing_slots and len(missing_slots) > 0:
+        # Heurísticas Obligatorias overrides (is_interview pisa a todas)
+        if is_interview:
+            return "critical"
+
+        if missing_slots:
             category = "transactional"
         
-        if product == "ats" and intent not in self.STATIC_INTENTS:
-            if category in ["static", "transactional"]:
-                category = "conversational"
-        
-        if is_interview:
-            category = "critical"
+        if product == "ats" and category in ("static", "transactional") and intent not in self._static_names:
+            category = "conversational"
 
         return category
 
     def _route(self, category):
-        if category == "static": return "ANTIGRAVITY"
-        if category == "transactional": return "ANTIGRAVITY"
-        if category == "conversational": return "DEEPSEEK"
-        if category == "critical": return "DEEPSEEK_THEN_GPT5"
-        return "ANTIGRAVITY"
+        return _ROUTE.get(category, "ANTIGRAVITY")
+
+    def cache_info(self):
+        if self._classify_cached is None:
+            return {"hits": 0, "misses": 0, "maxsize": 0, "currsize": 0}
+        info = self._classify_cached.cache_info()
+        return {"hits": info.hits, "misses": info.misses, "maxsize": info.maxsize, "currsize": info.currsize}
 
     def classify(self, input_data):
+        args = self._classify_args(input_data)
+        if self._classify_cached is None or len(args[0]) > CLASSIFY_CACHE_MAX_TEXT_LENGTH:
+            return self._classify(*args)
+        return self._classify_cached(*args)
+
+    def classify_many(self, items):
+        """
+        Clasifica una lista de inputs: mismo resultado que [classify(x) for x in items].
+        Los inputs repetidos dentro del batch se resuelven una sola vez (los resultados
+        son inmutables), incluidos los textos largos que no entran al cache LRU.
+        """
+        classify = self._classify
+        cached = self._classify_cached
+        classify_args = self._classify_args
+        seen = {}
+        results = []
+        append = results.append
+        for input_data in items:
+            args = classify_args(input_data)
+            if cached is not None and len(args[0]) <= CLASSIFY_CACHE_MAX_TEXT_LENGTH:
+                append(cached(*args))
+                continue
+            # Fuera del LRU: dedupe local al batch
+            result = seen.get(args)
+            if result is None:
+                result = seen[args] = classify(*args)
+            append(result)
+        return results
+
+    @staticmethod
+    def _classify_args(input_data):
         text = input_data.get("text", "")
         metadata = input_data.get("metadata", {})
         channel = input_data.get("channel", "web")
@@ -151,12 +389,25 @@ class V0Classifier:
         is_interview = metadata.get("is_interview", False)
         user_tier = metadata.get("user_tier", "free")
 
+        # Solo importan la veracidad de missing_slots / is_interview y el texto normalizado
+        return (text.lower().strip(), channel, product, bool(missing_slots), bool(is_interview), user_tier)
+
+    def _classify(self, text, channel, product, missing_slots, is_interview, user_tier):
+        """
+        Clasificación pura para las entradas dadas (memoizada por classify).
+        text llega lower().strip()eado; missing_slots / is_interview son bool.
+        """
+        # Un solo pase de keywords alimenta intent y riesgo
+        keyword_hits = self._scan_keywords(text) if self._automaton is not None else None
+
         # 1. Intent & Complexity
-        # Need to pass text to risk calc too, effectively mocked here
-        intent, complexity_score = self._detect_intent_and_complexity(text, missing_slots)
+        intent, complexity_score = self._detect_intent_and_complexity(text, missing_slots, keyword_hits)
 
         # 2. Risk Score
-        risk_score = self._calculate_risk(product, intent, {"text": text, "channel": channel, "is_interview": is_interview, "user_tier": user_tier})
+        risk_score = self._calculate_risk(
+            product, intent, text, channel=channel, is_interview=is_interview, user_tier=user_tier,
+            risk_hits=keyword_hits[2] if keyword_hits is not None else None
+        )
         
         # 3. Category Determination (Overrides based on heuristics)
         category = self._determine_category(intent, missing_slots, product, is_interview, complexity_score)
@@ -165,21 +416,36 @@ class V0Classifier:
         route_hint = self._route(category)
 
         # 5. Reason
-        reason = f"Category: {category} matched. C={complexity_score}, R={risk_score}."
-        if missing_slots: reason = "Transaccional: Faltan slots."
-        if intent in self.STATIC_INTENTS: reason = "FAQ/Static directa."
+        # Misma precedencia que la cascada de overrides: interview > static > slots;
+        # el f-string solo se arma si ninguna aplica.
         if is_interview: reason = "Crítico: Entrevista activa."
+        elif intent in self._static_names: reason = "FAQ/Static directa."
+        elif missing_slots: reason = "Transaccional: Faltan slots."
+        else: reason = f"Category: {category} matched. C={complexity_score}, R={risk_score}."
 
 
-        return {
-            "intent": intent,
-            "category": category,
-            "complexity_score": complexity_score,
-            "risk_score": risk_score,
-            "confidence": 0.95 if complexity_score < 40 else 0.85, # Simulated confidence
-            "route_hint": route_hint,
-            "reason": reason
-        }
+        # Posicional: NamedTuple con keywords cuesta ~2x
+        return ClassifyResult(
+            intent,
+            category,
+            complexity_score,
+            risk_score,
+            0.95 if complexity_score < 40 else 0.85, # Simulated confidence
+            route_hint,
+            reason
+        )
+
+# Instancia compartida: después de __init__ no hay estado mutable (re.Pattern,
+# frozensets y el autómata solo se leen), así que es segura entre threads.
+_DEFAULT = V0Classifier()
+
+def classify(input_data):
+    """Clasifica con la instancia compartida (sin reconstruir patrones por request)."""
+    return _DEFAULT.classify(input_data)
+
+def classify_many(items):
+    """Versión batch de classify() sobre la instancia compartida."""
+    return _DEFAULT.classify_many(items)
 
 if __name__ == "__main__":
     # Test Exec in main
@@ -193,7 +459,7 @@ if __name__ == "__main__":
         "metadata": {"user_tier": "free", "missing_slots": []}
     }
     print(f"INPUT: {in1['text']}")
-    print(json.dumps(classifier.classify(in1), indent=2))
+    print(json.dumps(classifier.classify(in1)._asdict(), indent=2))
     print("-" * 20)
 
     # Example 2: ATS Evaluation
@@ -204,4 +470,4 @@ if __name__ == "__main__":
         "metadata": {"user_tier": "pro", "is_interview": False, "missing_slots": []} # Context suggests evaluation
     }
     print(f"INPUT: {in2['text']}")
-    print(json.dumps(classifier.classify(in2), indent=2))
+    print(json.dumps(classifier.classify(in2)._asdict(), indent=2))